@@ -4,8 +4,11 @@ Provides /chat endpoint for grounded question-answering.
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
+import asyncio
+import os
+import time
 import uuid
 from pathlib import Path
 
@@ -22,12 +25,112 @@ data_loader = None
 retriever = None
 chatbot_engine = None
 chat_logger = None
+search_queue = None
+log_queue = None
+worker_slots = None  # bounds concurrent blocking calls handed to threads
+
+# Search micro-batching settings
+SEARCH_TOP_K = 5
+SEARCH_BATCH_SIZE = 32
+SEARCH_FLUSH_INTERVAL = 0.02  # seconds to wait for more queries before searching
+
+
+def _new_session_id() -> str:
+    """Generate a time-ordered UUIDv7 so session ids sort by creation time in logs."""
+    if hasattr(uuid, "uuid7"):  # Python 3.14+
+        return str(uuid.uuid7())
+    
+    # 48-bit ms timestamp | version 7 | 12 random bits | RFC 4122 variant | 62 random bits
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (timestamp_ms & ((1 << 48) - 1)) << 80
+        | 0x7 << 76
+        | ((rand >> 62) & 0xFFF) << 64
+        | 0b10 << 62
+        | (rand & ((1 << 62) - 1))
+    )
+    return str(uuid.UUID(int=value))
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run CPU- or IO-bound work in a worker thread so the event loop stays free."""
+    async with worker_slots:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def _search_worker(queue: asyncio.Queue):
+    """Coalesce queued searches into batches and resolve their futures."""
+    while True:
+        batch = [await queue.get()]
+        
+        # Give concurrent requests a short window to join the batch
+        await asyncio.sleep(SEARCH_FLUSH_INTERVAL)
+        while len(batch) < SEARCH_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        
+        queries = [query for query, _, _ in batch]
+        preferences = [preference for _, preference, _ in batch]
+        
+        try:
+            results = await _run_blocking(retriever.search_batch, queries, SEARCH_TOP_K, preferences)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+async def _log_worker(queue: asyncio.Queue):
+    """Write queued log entries in batches, off the request path.
+    
+    A None entry on the queue stops the worker once the batch holding it
+    has been written, so shutdown never drops entries already dequeued.
+    """
+    stopping = False
+    while not stopping:
+        batch = [await queue.get()]
+        
+        # Take everything that piled up while the previous batch was written
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        
+        if None in batch:
+            stopping = True
+            batch = [entry for entry in batch if entry is not None]
+            if not batch:
+                break
+        
+        try:
+            await _run_blocking(chat_logger.log_batch, batch)
+        except Exception as e:
+            print(f"Failed to write chat logs: {e}")
+
+
+def _flush_logs(queue: asyncio.Queue):
+    """Synchronously write any log entries still queued."""
+    remaining = []
+    while not queue.empty():
+        remaining.append(queue.get_nowait())
+    if remaining:
+        chat_logger.log_batch(remaining)
+
+
+async def _batched_search(query: str, source_preference: str):
+    """Queue a search for the batch worker and wait for its results."""
+    future = asyncio.get_running_loop().create_future()
+    search_queue.put_nowait((query, source_preference, future))
+    return await future
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize components on startup and clean up on shutdown."""
-    global data_loader, retriever, chatbot_engine, chat_logger
+    global data_loader, retriever, chatbot_engine, chat_logger, search_queue, log_queue, worker_slots
     
     # Paths to data files
     base_path = Path(__file__).parent
@@ -39,12 +142,12 @@ async def lifespan(app: FastAPI):
     data_loader = DataLoader(str(excel_path), str(docx_path))
     
     retriever = Retriever()
-    index_file = base_path / "index.npz"
+    index_dir = base_path / "index"
     index_loaded = False
     
-    if index_file.exists():
-        print(f"Found cached index at {index_file}, loading...")
-        if retriever.load_index(str(index_file)):
+    if index_dir.exists():
+        print(f"Found cached index at {index_dir}, loading...")
+        if retriever.load_index(str(index_dir)):
             print("Successfully loaded cached index.")
             index_loaded = True
             
@@ -63,12 +166,27 @@ async def lifespan(app: FastAPI):
     # Initialize logger
     chat_logger = ChatLogger()
     
+    # Start search batching worker
+    worker_slots = asyncio.Semaphore(os.cpu_count() or 4)
+    search_queue = asyncio.Queue()
+    search_task = asyncio.create_task(_search_worker(search_queue))
+    
+    # Start background log writer
+    log_queue = asyncio.Queue()
+    log_task = asyncio.create_task(_log_worker(log_queue))
+    
     print("Chatbot ready!")
     
     yield
     
-    # Cleanup (if any)
+    # Cleanup
     print("Shutting down...")
+    search_task.cancel()
+    # Let the log writer finish its in-flight batch before closing the logger
+    log_queue.put_nowait(None)
+    await log_task
+    _flush_logs(log_queue)
+    chat_logger.close()
 
 
 # Initialize FastAPI app
@@ -90,7 +208,11 @@ app.add_middleware(
 
 
 # Request/Response models
+# Every endpoint declares a response model so FastAPI serializes the
+# response straight to JSON bytes with pydantic-core.
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     session_id: Optional[str] = None
     user_message: str
 
@@ -104,7 +226,27 @@ class ChatResponse(BaseModel):
     is_unknown: bool = False
 
 
-@app.get("/")
+class StatusResponse(BaseModel):
+    status: str
+    message: str
+
+
+class SourceUsage(BaseModel):
+    doc_only: int
+    excel_only: int
+    both: int
+
+
+class MetricsResponse(BaseModel):
+    total_turns: int
+    source_usage: SourceUsage
+    unknown_responses: int
+    clarifications_asked: int
+    safety_refusals: int
+    unique_sessions: int
+
+
+@app.get("/", response_model=StatusResponse)
 async def root():
     """Health check endpoint."""
     return {
@@ -125,7 +267,7 @@ async def chat(request: ChatRequest):
         ChatResponse with assistant message, source citation, and metadata
     """
     # Generate session ID if not provided
-    session_id = request.session_id or str(uuid.uuid4())
+    session_id = request.session_id or _new_session_id()
     user_message = request.user_message.strip()
     
     if not user_message:
@@ -139,14 +281,14 @@ async def chat(request: ChatRequest):
     
     if needs_clarification:
         # Log clarification request
-        chat_logger.log_query(
+        log_queue.put_nowait(dict(
             session_id=session_id,
             user_message=user_message,
             assistant_message=clarification_msg,
             source_used="none",
             retrieved_count=0,
             is_clarification=True
-        )
+        ))
         
         return ChatResponse(
             session_id=session_id,
@@ -159,12 +301,8 @@ async def chat(request: ChatRequest):
     # Classify query to determine source preference
     source_preference = retriever.classify_query(enhanced_query)
     
-    # Retrieve relevant context
-    doc_results, excel_results = retriever.search(
-        enhanced_query,
-        top_k=5,
-        source_preference=source_preference
-    )
+    # Retrieve relevant context (batched with concurrent requests)
+    doc_results, excel_results = await _batched_search(enhanced_query, source_preference)
     
     # Get best results
     best_results, primary_source = retriever.get_best_results(
@@ -172,7 +310,8 @@ async def chat(request: ChatRequest):
     )
     
     # Generate response
-    assistant_message, source_citation = chatbot_engine.generate_response(
+    assistant_message, source_citation, response_kind = await _run_blocking(
+        chatbot_engine.generate_response,
         user_message,
         best_results,
         primary_source,
@@ -180,11 +319,11 @@ async def chat(request: ChatRequest):
     )
     
     # Determine if response is unknown or safety refusal
-    is_unknown = "don't know based on the available data" in assistant_message
-    is_safety_refusal = "cannot provide medical advice" in assistant_message
+    is_unknown = response_kind == 'unknown'
+    is_safety_refusal = response_kind == 'safety'
     
     # Log the interaction
-    chat_logger.log_query(
+    log_queue.put_nowait(dict(
         session_id=session_id,
         user_message=user_message,
         assistant_message=assistant_message,
@@ -192,7 +331,7 @@ async def chat(request: ChatRequest):
         retrieved_count=len(best_results),
         is_unknown=is_unknown,
         is_safety_refusal=is_safety_refusal
-    )
+    ))
     
     return ChatResponse(
         session_id=session_id,
@@ -203,17 +342,16 @@ async def chat(request: ChatRequest):
     )
 
 
-@app.get("/api/metrics")
+@app.get("/api/metrics", response_model=MetricsResponse)
 async def get_metrics():
     """Get chatbot usage metrics."""
     return chat_logger.get_metrics_summary()
 
 
-@app.post("/api/reset_session")
+@app.post("/api/reset_session", response_model=StatusResponse)
 async def reset_session(session_id: str):
     """Reset conversation history for a session."""
-    if session_id in chatbot_engine.conversation_history:
-        del chatbot_engine.conversation_history[session_id]
+    chatbot_engine.reset_session(session_id)
     return {"status": "success", "message": f"Session {session_id} reset"}
 
 
@@ -2,325 +2,386 @@
 Chatbot Module
 Implements grounded response generation with safety guardrails.
 """
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Deque, FrozenSet, NamedTuple, Literal
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+import io
 import re
+import threading
 from datetime import datetime
 
+from data_loader import build_match_text
+from retriever import Hit
+
+
+# What kind of reply a turn produced
+ResponseKind = Literal['answer', 'unknown', 'safety', 'greeting']
+
+# Common drug names (ordered: the first listed wins when resolving references)
+_DRUGS = (
+    'imatinib', 'pembrolizumab', 'metformin', 'nivolumab',
+    'trastuzumab', 'atezolizumab', 'durvalumab', 'osimertinib'
+)
+_DRUG_RE = re.compile(r'\b(?:' + '|'.join(_DRUGS) + r')\b', re.IGNORECASE)
+
+_PRONOUNS = frozenset({'that', 'it', 'this', 'them'})
+
+# Medical advice indicators
+_MEDICAL_ADVICE_KEYWORDS = (
+    'should i take', 'can i take', 'prescribe', 'recommend taking',
+    'what should i do', 'treatment plan', 'medical advice',
+    'diagnose', 'can i stop', 'should i stop'
+)
+
+# Clinical decision keywords - refined to allow grounded lookup
+_CLINICAL_DECISION_KEYWORDS = (
+    'change my dose', 'switch to', 'should i stop'
+)
+
+# Harmful / Inappropriate keywords
+_HARMFUL_KEYWORDS = (
+    'bomb', 'suicide', 'kill', 'murder', 'illegal', 'hack', 'poison',
+    'weapon', 'terror', 'drug abuse', 'high', 'recreational'
+)
+
+# Substring alternations per category, plus one combined scan so the
+# common no-hit query is checked in a single pass
+_MEDICAL_ADVICE_ALT = '|'.join(map(re.escape, _MEDICAL_ADVICE_KEYWORDS + _CLINICAL_DECISION_KEYWORDS))
+_HARMFUL_ALT = '|'.join(map(re.escape, _HARMFUL_KEYWORDS))
+_MEDICAL_ADVICE_RE = re.compile(_MEDICAL_ADVICE_ALT)
+_SAFETY_RE = re.compile(f'(?P<advice>{_MEDICAL_ADVICE_ALT})|(?P<harmful>{_HARMFUL_ALT})')
+
+_MEDICAL_ADVICE_MSG = (
+    "I cannot provide medical advice or prescriptive recommendations. "
+    "Please consult the official drug label documentation or a qualified "
+    "healthcare professional for clinical decisions."
+)
+_HARMFUL_MSG = "I cannot fulfill this request as it violates safety policies."
+
+# Minimal stop words to ensure important terms (dose, adjustment) are counted
+_STOP_WORDS = frozenset({
+    'what', 'is', 'the', 'for', 'in', 'of', 'a', 'an', 'to', 'and', 'or', 'are', 
+    'about', 'tell', 'me', 'please', 'provide', 'give', 'how', 'much', 'can', 'i', 
+    'take', 'should', 'with', 'my', 'does', 'have', 'any', 'list', 'show', 'details',
+    'information', 'regarding', 'suggest', 'describe', 'explain', 'check',
+    'mentioned', 'mention', 'guidance', 'guide', 'label', 'discussed', 'discuss',
+    'reference', 'notes', 'note', 'described', 'finding', 'findings'
+})
+
+# Synonym Mapping to fix vocabulary mismatch
+_SYNONYMS = {
+    'side': ('adverse', 'events', 'ae', 'reaction', 'toxicity', 'safety'),
+    'effect': ('adverse', 'events', 'ae', 'reaction', 'outcome', 'efficacy'),
+    'effects': ('adverse', 'events', 'ae', 'reaction', 'outcomes'),
+    'adverse': ('side', 'effect', 'toxicity', 'safety'),
+    'renal': ('kidney', 'nephro', 'crcl', 'creatinine', 'gfr'),
+    'kidney': ('renal', 'nephro'),
+    'hepatic': ('liver', 'bilirubin', 'alt', 'ast'),
+    'liver': ('hepatic',),
+    'dose': ('dosage', 'dosing', 'schedule', 'amount', 'administer', 'administration'),
+    'dosage': ('dose', 'dosing', 'schedule', 'amount', 'administration'),
+    'guidance': ('recommendation', 'instruction', 'protocol', 'note', 'label', 'prescribing'),
+    'monitoring': ('check', 'assess', 'measure', 'test', 'exam'),
+    'label': ('prescribing', 'guidance', 'smpc', 'uspi', 'package'),
+    'indication': ('usage', 'treat', 'diagnosis', 'condition', 'disease'),
+}
+
+_GREETINGS = frozenset({
+    'hi', 'hello', 'hey', 'greetings', 'good morning', 'good afternoon',
+    'good evening', 'thanks', 'thank you'
+})
+
+_TOKEN_RE = re.compile(r'\w+')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
+class QueryCtx(NamedTuple):
+    """A user query normalized once per request and shared by every helper."""
+    raw: str
+    lower: str
+    tokens: Tuple[str, ...]
+    key_terms: FrozenSet[str]  # tokens minus stop words
+
+
+def _make_query_ctx(query: str) -> QueryCtx:
+    """Lowercase and tokenize a query once."""
+    lower = query.lower()
+    tokens = tuple(_TOKEN_RE.findall(lower))
+    return QueryCtx(query, lower, tokens, frozenset(tokens) - _STOP_WORDS)
+
+
+@lru_cache(maxsize=256)
+def _relevance_pattern(key_terms: FrozenSet[str]) -> Optional[re.Pattern]:
+    """Compile every accepted spelling of the query's key terms into one pattern."""
+    if not key_terms:
+        return None
+    
+    candidates = set()
+    for term in key_terms:
+        # 1. Direct match (also covers the plural term + 's')
+        candidates.add(term)
+        # 2. Plural/Singular
+        if term.endswith('s'):
+            candidates.add(term[:-1])
+        # 3. Synonym match
+        candidates.update(_SYNONYMS.get(term, ()))
+    
+    # Longest first so overlapping candidates resolve to the most specific
+    alternatives = sorted(candidates, key=lambda c: (-len(c), c))
+    return re.compile('|'.join(map(re.escape, alternatives)))
+
+
+def _mentioned_drugs(*texts: str) -> List[str]:
+    """Known drugs named in any of the texts, in _DRUGS priority order."""
+    found = {m.lower() for text in texts for m in _DRUG_RE.findall(text)}
+    return [drug for drug in _DRUGS if drug in found]
+
+
+@lru_cache(maxsize=1024)
+def _safety_verdict(query_lower: str) -> Tuple[bool, Optional[str]]:
+    """Cached safety classification of a lowercased query."""
+    match = _SAFETY_RE.search(query_lower)
+    if match is None:
+        return False, None
+    
+    if match.lastgroup == 'advice':
+        return True, _MEDICAL_ADVICE_MSG
+    
+    # Medical advice takes precedence; no advice keyword starts before this
+    # harmful hit (the advice branch would have matched first), so only the
+    # rest of the query needs checking
+    if _MEDICAL_ADVICE_RE.search(query_lower, match.start() + 1):
+        return True, _MEDICAL_ADVICE_MSG
+    
+    return True, _HARMFUL_MSG
+
+
+@lru_cache(maxsize=1024)
+def _is_greeting_text(query_lower: str) -> bool:
+    """Cached greeting check of a lowercased query."""
+    cleaned = _PUNCTUATION_RE.sub('', query_lower).strip()
+    return cleaned in _GREETINGS
+
+
+@lru_cache(maxsize=256)
+def _resolve_reference(query: str, last_user_msg: str, last_assistant_msg: str) -> str:
+    """Cached pronoun resolution of a query against the previous turn."""
+    # Check for pronouns
+    if _PRONOUNS.isdisjoint(query.lower().split()):
+        return query
+    
+    # Get last mentioned drug
+    drugs = _mentioned_drugs(last_user_msg, last_assistant_msg)
+    if drugs:
+        # Replace pronoun with drug name
+        return query + f" (referring to {drugs[0]})"
+    
+    return query
+
 
 class ChatbotEngine:
     """Generates grounded responses based on retrieved context."""
     
-    def __init__(self):
-        self.conversation_history = {}  # session_id -> list of turns
+    def __init__(self, max_sessions: int = 10000):
+        self.conversation_history = OrderedDict()  # session_id -> deque of turns, least recent first
         self.max_history = 5  # Keep last 5 turns for context
+        self.max_sessions = max_sessions  # Evict least recently used sessions beyond this
+        # Responses are generated on worker threads while the event loop also
+        # reads and resets sessions; reentrant so helpers can nest
+        self._history_lock = threading.RLock()
         
-    def _get_history(self, session_id: str) -> List[Dict]:
+    def _get_history(self, session_id: str) -> Deque[Dict]:
         """Get conversation history for a session."""
-        if session_id not in self.conversation_history:
-            self.conversation_history[session_id] = []
-        return self.conversation_history[session_id]
+        with self._history_lock:
+            history = self.conversation_history.get(session_id)
+            if history is None:
+                history = deque(maxlen=self.max_history)
+                self.conversation_history[session_id] = history
+                if len(self.conversation_history) > self.max_sessions:
+                    self.conversation_history.popitem(last=False)
+            else:
+                self.conversation_history.move_to_end(session_id)
+            return history
+    
+    def _last_turn(self, session_id: str) -> Optional[Dict]:
+        """Most recent turn of a session, or None if it has none yet."""
+        with self._history_lock:
+            history = self._get_history(session_id)
+            return history[-1] if history else None
+    
+    def reset_session(self, session_id: str):
+        """Forget a session's conversation history."""
+        with self._history_lock:
+            self.conversation_history.pop(session_id, None)
     
     def _add_to_history(self, session_id: str, user_msg: str, assistant_msg: str, sources_used: str):
         """Add a turn to conversation history."""
-        history = self._get_history(session_id)
-        history.append({
+        turn = {
             'timestamp': datetime.now().isoformat(),
             'user_message': user_msg,
             'assistant_message': assistant_msg,
             'sources_used': sources_used
-        })
-        # Keep only last N turns
-        if len(history) > self.max_history:
-            history.pop(0)
+        }
+        with self._history_lock:
+            # deque(maxlen) keeps only the last N turns
+            self._get_history(session_id).append(turn)
     
     def _extract_context_from_history(self, session_id: str) -> str:
         """Extract relevant context from recent conversation."""
-        history = self._get_history(session_id)
-        if not history:
+        # Get the last turn to understand context
+        last_turn = self._last_turn(session_id)
+        if last_turn is None:
             return ""
         
-        # Get the last turn to understand context
-        last_turn = history[-1]
         context_info = []
         
         # Extract drug names and topics mentioned
-        last_user_msg = last_turn['user_message'].lower()
-        last_assistant_msg = last_turn['assistant_message'].lower()
-        
-        # Common drug names
-        drugs = ['imatinib', 'pembrolizumab', 'metformin', 'nivolumab', 
-                'trastuzumab', 'atezolizumab', 'durvalumab', 'osimertinib']
-        
-        for drug in drugs:
-            if drug in last_user_msg or drug in last_assistant_msg:
-                context_info.append(f"Previously discussed drug: {drug}")
+        for drug in _mentioned_drugs(last_turn['user_message'], last_turn['assistant_message']):
+            context_info.append(f"Previously discussed drug: {drug}")
         
         return " | ".join(context_info)
     
     def _resolve_pronouns(self, query: str, session_id: str) -> str:
         """Resolve pronouns like 'that', 'it' using conversation history."""
-        history = self._get_history(session_id)
-        if not history:
+        last_turn = self._last_turn(session_id)
+        if last_turn is None:
             return query
         
-        query_lower = query.lower()
-        
-        # Check for pronouns
-        pronouns = ['that', 'it', 'this', 'them']
-        has_pronoun = any(pronoun in query_lower.split() for pronoun in pronouns)
-        
-        if has_pronoun and history:
-            # Get last mentioned drug
-            last_turn = history[-1]
-            last_msg = last_turn['user_message'] + " " + last_turn['assistant_message']
-            
-            drugs = ['imatinib', 'pembrolizumab', 'metformin', 'nivolumab', 
-                    'trastuzumab', 'atezolizumab', 'durvalumab', 'osimertinib']
-            
-            for drug in drugs:
-                if drug.lower() in last_msg.lower():
-                    # Replace pronoun with drug name
-                    enhanced_query = query + f" (referring to {drug})"
-                    return enhanced_query
-        
-        return query
+        return _resolve_reference(query, last_turn['user_message'], last_turn['assistant_message'])
     
-    def _check_safety_guardrails(self, query: str) -> Tuple[bool, Optional[str]]:
+    def _check_safety_guardrails(self, ctx: QueryCtx) -> Tuple[bool, Optional[str]]:
         """Check if query violates safety guidelines."""
-        query_lower = query.lower()
-        
-        # Medical advice indicators
-        medical_advice_keywords = [
-            'should i take', 'can i take', 'prescribe', 'recommend taking',
-            'what should i do', 'treatment plan', 'medical advice',
-            'diagnose', 'can i stop', 'should i stop'
-        ]
-        
-        # Clinical decision keywords - refined to allow grounded lookup
-        clinical_decision_keywords = [
-            'change my dose', 'switch to', 'should i stop'
-        ]
-        
-        # Harmful / Inappropriate keywords
-        harmful_keywords = [
-            'bomb', 'suicide', 'kill', 'murder', 'illegal', 'hack', 'poison',
-            'weapon', 'terror', 'drug abuse', 'high', 'recreational'
-        ]
-        
-        for keyword in medical_advice_keywords + clinical_decision_keywords:
-            if keyword in query_lower:
-                return True, (
-                    "I cannot provide medical advice or prescriptive recommendations. "
-                    "Please consult the official drug label documentation or a qualified "
-                    "healthcare professional for clinical decisions."
-                )
-        
-        for keyword in harmful_keywords:
-             if keyword in query_lower:
-                 return True, "I cannot fulfill this request as it violates safety policies."
-        
-        return False, None
+        return _safety_verdict(ctx.lower)
     
-    def _is_relevant(self, query: str, result: Dict) -> bool:
-        """Check if result is relevant using strict ratio matching."""
-        # Clean and tokenize query
-        # Minimal stop words to ensure important terms (dose, adjustment) are counted
-        stop_words = {
-            'what', 'is', 'the', 'for', 'in', 'of', 'a', 'an', 'to', 'and', 'or', 'are', 
-            'about', 'tell', 'me', 'please', 'provide', 'give', 'how', 'much', 'can', 'i', 
-            'take', 'should', 'with', 'my', 'does', 'have', 'any', 'list', 'show', 'details',
-            'information', 'regarding', 'suggest', 'describe', 'explain', 'check',
-            'mentioned', 'mention', 'guidance', 'guide', 'label', 'discussed', 'discuss',
-            'reference', 'notes', 'note', 'described', 'finding', 'findings'
-        }
-        
-        # Extract terms
-        query_terms = re.findall(r'\w+', query.lower())
-        key_terms = {t for t in query_terms if t not in stop_words}
-        
+    def _is_relevant(self, pattern: Optional[re.Pattern], result: Hit) -> bool:
+        """Check if result matches the query's precompiled relevance pattern."""
         # If no key terms, rely on semantic search score only (pass-through)
-        if not key_terms:
+        if pattern is None:
             return True
             
-        # Check against result content and metadata
-        content = result.get('content', '').lower()
-        data = result.get('structured_data', {})
-        
-        # Construct a representation of the result
-        result_text = content + " " + str(data.get('drug_name', '')) + " " + \
-                      str(data.get('indication', '')) + " " + str(data.get('ae_terms', '')) + " " + \
-                      str(data.get('dose', '')) + " " + str(data.get('severity', ''))
-        result_text = result_text.lower()
-        
-        # Synonym Mapping to fix vocabulary mismatch
-        synonyms = {
-            'side': ['adverse', 'events', 'ae', 'reaction', 'toxicity', 'safety'],
-            'effect': ['adverse', 'events', 'ae', 'reaction', 'outcome', 'efficacy'],
-            'effects': ['adverse', 'events', 'ae', 'reaction', 'outcomes'],
-            'adverse': ['side', 'effect', 'toxicity', 'safety'],
-            'renal': ['kidney', 'nephro', 'crcl', 'creatinine', 'gfr'],
-            'kidney': ['renal', 'nephro'],
-            'hepatic': ['liver', 'bilirubin', 'alt', 'ast'],
-            'liver': ['hepatic'],
-            'dose': ['dosage', 'dosing', 'schedule', 'amount', 'administer', 'administration'],
-            'dosage': ['dose', 'dosing', 'schedule', 'amount', 'administration'],
-            'guidance': ['recommendation', 'instruction', 'protocol', 'note', 'label', 'prescribing'],
-            'monitoring': ['check', 'assess', 'measure', 'test', 'exam'],
-            'label': ['prescribing', 'guidance', 'smpc', 'uspi', 'package'],
-            'indication': ['usage', 'treat', 'diagnosis', 'condition', 'disease'],
-        }
-
-        # Calculate matching ratio
-        matches = 0
-        matched_terms = set()
+        # Check against result content and metadata, lowercased once at load time
+        chunk = result.chunk
+        result_text = chunk.get('match_text')
+        if result_text is None:
+            result_text = build_match_text(chunk.get('content', ''), chunk.get('structured_data', {}))
         
-        for term in key_terms:
-            term_matched = False
-            # 1. Direct match
-            if term in result_text: 
-                matches += 1
-                matched_terms.add(term)
-                continue
-            
-            # 2. Plural/Singular
-            if term.endswith('s') and term[:-1] in result_text:
-                matches += 1
-                matched_terms.add(term)
-                continue
-            if term + 's' in result_text:
-                matches += 1
-                matched_terms.add(term)
-                continue
-                
-            # 3. Synonym match
-            if term in synonyms:
-                for syn in synonyms[term]:
-                    if syn in result_text:
-                        matches += 1
-                        matched_terms.add(term) # Count the term as matched
-                        term_matched = True
-                        break
-            if term_matched:
-                continue
-                
-        # Calculate ratio
         # RELAXED LOGIC: We just need significant overlap.
         # If ANY important medical term matches (e.g. drug name, condition), we accept it.
         # Preventing "Space" -> "Trastuzumab" (0 matches).
-        
-        if len(key_terms) == 0:
-            return True
-            
-        ratio = matches / len(key_terms)
-        
-        # Threshold: Just require AT LEAST ONE meaningful match (Ratio > 0)
-        # But if query is long (>3 terms), require slightly more confidence?
-        # Actually, "Any Match" is safest for "False Negatives", provided stop words are aggressive.
-        # "Space" (1 term) -> 0 match -> Fail.
-        # "Cardio monitoring" (2 terms) -> "Monitoring" match -> Pass.
-        
-        return matches > 0
+        # A single scan of the result text checks every term, plural and synonym at once.
+        return pattern.search(result_text) is not None
 
-    def _is_greeting(self, query: str) -> bool:
+    def _is_greeting(self, ctx: QueryCtx) -> bool:
         """Check if the query is a simple greeting."""
-        greetings = {'hi', 'hello', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening', 'thanks', 'thank you'}
-        cleaned = re.sub(r'[^\w\s]', '', query.lower()).strip()
-        return cleaned in greetings
+        return _is_greeting_text(ctx.lower)
 
-    def _extract_relevant_snippet(self, content: str, query: str) -> str:
+    def _extract_relevant_snippet(self, content: str, ctx: QueryCtx) -> str:
         """Extract the most relevant window of text containing query terms."""
-        content_lower = content.lower()
-        query_terms = [t for t in re.findall(r'\w+', query.lower()) if len(t) > 3] # Ignora short words
+        # Term -> number of times it appears in the query
+        query_terms = Counter(t for t in ctx.tokens if len(t) > 3) # Ignora short words
         
         if not query_terms:
             return content[:500]
-            
-        # Find best window
-        best_window = content[:500]
-        max_density = 0
         
         # Split content into sentences or chunks of 200 chars
         sentences = content.split('. ')
         
+        # Terms are word characters only, so they never span the '. ' separator:
+        # lowercase and scan each sentence once, then score windows from the hits
+        sentence_hits = []
+        for sentence in sentences:
+            sentence_lower = sentence.lower()
+            sentence_hits.append({t for t in query_terms if t in sentence_lower})
+        
+        # Find best window
+        best_start = 0
+        max_density = 0
+        
         for i in range(len(sentences)):
             # Create a window of 3 sentences
-            window_slice = sentences[i:i+3]
-            window_text = ". ".join(window_slice)
+            window_terms = sentence_hits[i].union(*sentence_hits[i+1:i+3])
             
             # Count term density
-            count = sum(1 for t in query_terms if t in window_text.lower())
+            count = sum(query_terms[t] for t in window_terms)
             
             if count > max_density:
                 max_density = count
-                best_window = window_text
+                best_start = i
         
         # If we found a good window, return it (cleaned)
         if max_density > 0:
-            return "..." + best_window + "..."
+            return "..." + ". ".join(sentences[best_start:best_start+3]) + "..."
             
         return content[:500]
 
     def generate_response(
         self,
         query: str,
-        retrieved_results: List[Dict],
+        retrieved_results: List[Hit],
         primary_source: str,
         session_id: str
-    ) -> Tuple[str, str]:
+    ) -> Tuple[str, str, ResponseKind]:
         """
         Generate a grounded response based on retrieved context.
-        Returns: (response, source_citation)
+        Returns: (response, source_citation, response_kind)
         """
+        # Normalize the query once for every check below
+        ctx = _make_query_ctx(query)
+        
         # Check safety guardrails
-        is_unsafe, safety_msg = self._check_safety_guardrails(query)
+        is_unsafe, safety_msg = self._check_safety_guardrails(ctx)
         if is_unsafe:
             self._add_to_history(session_id, query, safety_msg, "none")
-            return safety_msg, "none"
+            return safety_msg, "none", 'safety'
             
         # Check if greeting
-        if self._is_greeting(query):
+        if self._is_greeting(ctx):
             response = "Hello! I am your Clinical Trial Assistant. How can I help you regarding drug dosages, adverse events, or clinical contexts?"
             self._add_to_history(session_id, query, response, "none")
-            return response, "none"
+            return response, "none", 'greeting'
         
-        # RELEVANCE FILTERING
+        # RELEVANCE FILTERING (single pass)
         # 1. Score Filter (exclude very distant semantic matches)
-        score_filtered = [r for r in retrieved_results if r.get('score', 0) < 1.4]
-        
-        # 2. Keyword Relevance Filter
-        relevant_results = [r for r in score_filtered if self._is_relevant(query, r)]
+        # 2. Keyword Relevance Filter against the query's pattern, compiled once
+        pattern = _relevance_pattern(ctx.key_terms)
+        relevant_results = [
+            r for r in retrieved_results
+            if r.score < 1.4 and self._is_relevant(pattern, r)
+        ]
         
         # If no relevant results after filtering
         if not relevant_results:
             response = "I apologize, but I couldn't find relevant information regarding your query in the provided clinical trial documents."
             self._add_to_history(session_id, query, response, "none")
-            return response, "none"
+            return response, "none", 'unknown'
             
         # Use filtered results
         retrieved_results = relevant_results
 
-        # Build response from retrieved context
-        response_parts = []
+        # Build response from retrieved context into a single buffer
+        buf = io.StringIO()
         sources_used = set()
         
         # Group results by source
-        doc_results = [r for r in retrieved_results if r['source_type'] == 'doc']
-        excel_results = [r for r in retrieved_results if r['source_type'] == 'excel']
+        doc_results = [r for r in retrieved_results if r.source_type == 'doc']
+        excel_results = [r for r in retrieved_results if r.source_type == 'excel']
         
         # Generate response based on source type
         if excel_results:
-            response_parts.extend(self._format_excel_results(excel_results, query))
+            self._format_excel_results(excel_results, ctx, buf)
             sources_used.add("Pharma_Clinical_Trial_AllDrugs.xlsx")
         
         if doc_results:
-            response_parts.extend(self._format_doc_results(doc_results, query))
+            self._format_doc_results(doc_results, ctx, buf)
             sources_used.add("Pharma_Clinical_Trial_Notes.docx")
         
         # Combine response
-        if response_parts:
-            response = "\n\n".join(response_parts)
+        if buf.tell():
+            response = buf.getvalue()
+            response_kind = 'answer'
         else:
             response = "I don't know based on the available data."
+            response_kind = 'unknown'
             sources_used = set()
         
         # Format source citation
@@ -332,12 +393,20 @@ class ChatbotEngine:
         # Add to history
         self._add_to_history(session_id, query, response, source_citation)
         
-        return response, source_citation
+        return response, source_citation, response_kind
+    
+    def _write_block(self, buf: io.StringIO, lines: List[str]):
+        """Write one block of lines, separated from earlier blocks by a blank line."""
+        if buf.tell():
+            buf.write("\n\n")
+        buf.write(lines[0])
+        for line in lines[1:]:
+            buf.write("\n")
+            buf.write(line)
     
-    def _format_excel_results(self, results: List[Dict], query: str) -> List[str]:
-        """Format Excel results into readable text."""
-        formatted = []
-        query_lower = query.lower()
+    def _format_excel_results(self, results: List[Hit], ctx: QueryCtx, buf: io.StringIO):
+        """Write Excel results into the response buffer as readable text."""
+        query_lower = ctx.lower
         
         # Determine what information to extract
         show_dose = 'dose' in query_lower or 'dosing' in query_lower or 'dosage' in query_lower
@@ -348,7 +417,7 @@ class ChatbotEngine:
         # Group by drug
         drug_data = {}
         for result in results[:3]:  # Top 3 results
-            data = result.get('structured_data', {})
+            data = result.chunk.get('structured_data', {})
             drug = data.get('drug_name', 'Unknown')
             
             if drug not in drug_data:
@@ -403,31 +472,26 @@ class ChatbotEngine:
                 if severities:
                     parts.append(f"- Severity: {', '.join(severities)}")
             
-            formatted.append("\n".join(parts))
-        
-        return formatted
+            self._write_block(buf, parts)
     
-    def _format_doc_results(self, results: List[Dict], query: str) -> List[str]:
-        """Format Doc results into readable text."""
-        formatted = []
-        
+    def _format_doc_results(self, results: List[Hit], ctx: QueryCtx, buf: io.StringIO):
+        """Write Doc results into the response buffer as readable text."""
         for result in results[:2]:  # Top 2 doc results
-            content = result.get('content', '')
+            chunk = result.chunk
+            content = chunk.get('content', '')
             
             # For table data, format nicely
-            if result.get('type') == 'table':
-                structured = result.get('structured_data', {})
+            if chunk.get('type') == 'table':
+                structured = chunk.get('structured_data', {})
                 if structured:
                     parts = []
                     for key, value in structured.items():
                         if value:
                             parts.append(f"**{key}**: {value}")
                     if parts:
-                        formatted.append("\n".join(parts))
+                        self._write_block(buf, parts)
             else:
                 # For paragraphs, SMART SNIPPET EXTRACTION
                 if content:
-                    snippet = self._extract_relevant_snippet(content, query)
-                    formatted.append(snippet)
-        
-        return formatted
+                    snippet = self._extract_relevant_snippet(content, ctx)
+                    self._write_block(buf, [snippet])
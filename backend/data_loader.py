@@ -2,55 +2,242 @@
 Data Loader Module
 Loads and processes both Excel and DOCX source files.
 """
-import openpyxl
-from docx import Document
-from typing import List, Dict, Tuple, Any
+from lxml import etree
+from typing import List, Dict, Tuple, Any, Optional, Iterator
+from pathlib import Path
+import posixpath
+import hashlib
+import pickle
+import zipfile
 import re
+import os
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # fall back to openpyxl's streaming reader
+    CalamineWorkbook = None
+
+
+# Bump when the chunk format changes so stale caches are ignored
+CACHE_VERSION = 2
+
+# Structured fields folded into a chunk's keyword-match text
+MATCH_FIELDS = ('drug_name', 'indication', 'ae_terms', 'dose', 'severity')
+
+
+def build_match_text(content: str, data: Dict) -> str:
+    """Lowercased content plus key structured fields, scanned by keyword relevance checks."""
+    return " ".join([content] + [str(data.get(field, '')) for field in MATCH_FIELDS]).lower()
+
+
+def _read_first_sheet(excel_path: str) -> List[List[Any]]:
+    """Read the first worksheet as a list of row value lists."""
+    if CalamineWorkbook is not None:
+        return CalamineWorkbook.from_path(excel_path).get_sheet_by_index(0).to_python()
+    
+    from openpyxl import load_workbook
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        return [list(row) for row in wb.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def _cell_text(value: Any) -> str:
+    """Stringify a cell value, rendering whole-number floats without '.0'."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+# WordprocessingML tags
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_BODY = _W + 'body'
+_W_P = _W + 'p'
+_W_R = _W + 'r'
+_W_T = _W + 't'
+_W_TAB = _W + 'tab'
+_W_PTAB = _W + 'ptab'
+_W_BR = _W + 'br'
+_W_CR = _W + 'cr'
+_W_NO_BREAK_HYPHEN = _W + 'noBreakHyphen'
+_W_HYPERLINK = _W + 'hyperlink'
+_W_TBL = _W + 'tbl'
+_W_TR = _W + 'tr'
+_W_TC = _W + 'tc'
+_W_TR_PR = _W + 'trPr'
+_W_TC_PR = _W + 'tcPr'
+_W_GRID_BEFORE = _W + 'gridBefore'
+_W_GRID_SPAN = _W + 'gridSpan'
+_W_V_MERGE = _W + 'vMerge'
+_W_VAL = _W + 'val'
+_W_TYPE = _W + 'type'
+
+_OFFICE_DOCUMENT_REL = (
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+)
+_PACKAGE_RELS = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+
+
+def _main_document_part(package: zipfile.ZipFile) -> str:
+    """Locate the main document XML part (normally word/document.xml)."""
+    rels = etree.fromstring(package.read('_rels/.rels'))
+    for rel in rels.iter(_PACKAGE_RELS):
+        if rel.get('Type') == _OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get('Target').lstrip('/'))
+    return 'word/document.xml'
+
+
+def _iter_body_blocks(docx_path: str) -> Iterator[etree._Element]:
+    """Stream top-level <w:p> and <w:tbl> elements of the document body in order."""
+    with zipfile.ZipFile(docx_path) as package:
+        with package.open(_main_document_part(package)) as xml:
+            for _, elem in etree.iterparse(xml, events=('end',), tag=(_W_P, _W_TBL)):
+                parent = elem.getparent()
+                # Paragraphs inside table cells are read with their table
+                if parent is None or parent.tag != _W_BODY:
+                    continue
+                
+                yield elem
+                
+                # Drop processed blocks so memory stays flat
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+def _run_text(run: etree._Element) -> str:
+    """Text of a <w:r>, with tabs, breaks and hyphens translated like python-docx."""
+    parts = []
+    for e in run:
+        if e.tag == _W_T:
+            parts.append(e.text or '')
+        elif e.tag == _W_TAB or e.tag == _W_PTAB:
+            parts.append('\t')
+        elif e.tag == _W_BR:
+            # Page and column breaks have no text equivalent
+            if e.get(_W_TYPE, 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif e.tag == _W_CR:
+            parts.append('\n')
+        elif e.tag == _W_NO_BREAK_HYPHEN:
+            parts.append('-')
+    return ''.join(parts)
+
+
+def _paragraph_text(p: etree._Element) -> str:
+    """Text of a <w:p>, including runs nested in hyperlinks."""
+    parts = []
+    for child in p:
+        if child.tag == _W_R:
+            parts.append(_run_text(child))
+        elif child.tag == _W_HYPERLINK:
+            parts.extend(_run_text(r) for r in child.iterchildren(_W_R))
+    return ''.join(parts)
+
+
+def _int_property(props: Optional[etree._Element], tag: str, default: int) -> int:
+    """Integer w:val of a child property element, e.g. w:tcPr/w:gridSpan."""
+    if props is None:
+        return default
+    prop = props.find(tag)
+    if prop is None:
+        return default
+    return int(prop.get(_W_VAL, default))
+
+
+def _table_rows(tbl: etree._Element) -> List[List[str]]:
+    """
+    Cell texts for each row of a <w:tbl>.
+    Merged cells repeat their text once per grid column they cover, and
+    vertically merged continuations repeat the cell above, as python-docx does.
+    """
+    rows = []
+    above = {}  # grid offset -> (text, span) of the cell there in the previous row
+    
+    for tr in tbl.iterchildren(_W_TR):
+        cells = []
+        current = {}
+        offset = _int_property(tr.find(_W_TR_PR), _W_GRID_BEFORE, 0)
+        
+        for tc in tr.iterchildren(_W_TC):
+            tc_pr = tc.find(_W_TC_PR)
+            own_span = _int_property(tc_pr, _W_GRID_SPAN, 1)
+            v_merge = tc_pr.find(_W_V_MERGE) if tc_pr is not None else None
+            
+            if v_merge is not None and v_merge.get(_W_VAL, 'continue') == 'continue' and offset in above:
+                text, span = above[offset]
+            else:
+                text = '\n'.join(_paragraph_text(p) for p in tc.iterchildren(_W_P))
+                span = own_span
+            
+            current[offset] = (text, span)
+            cells.extend([text] * span)
+            offset += own_span
+        
+        rows.append(cells)
+        above = current
+    
+    return rows
 
 
 class DataLoader:
     """Handles loading and preprocessing of source documents."""
     
-    def __init__(self, excel_path: str, docx_path: str):
+    def __init__(self, excel_path: str, docx_path: str, cache_dir: Optional[str] = None):
         self.excel_path = excel_path
         self.docx_path = docx_path
         self.excel_data = [] # List of dicts
         self.doc_chunks = []
         
-    def load_excel(self) -> List[Dict[str, Any]]:
-        """Load Excel file via OpenPyXL and return as list of dicts."""
-        wb = openpyxl.load_workbook(self.excel_path, data_only=True)
-        ws = wb.active
+        # Parsed sources are cached next to the data files
+        # For Vercel/Serverless, we must use /tmp for writing files
+        if cache_dir is None:
+            if os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+                cache_dir = "/tmp/dataloader_cache"
+            else:
+                cache_dir = str(Path(excel_path).parent / "cache")
+        self.cache_dir = Path(cache_dir)
         
-        data = []
-        rows = list(ws.iter_rows(values_only=True))
+    def load_excel(self) -> List[Dict[str, Any]]:
+        """Load Excel file via Calamine (Rust parser) and return as list of dicts."""
+        rows = _read_first_sheet(self.excel_path)
         
         if not rows:
             return []
             
-        headers = [str(h).strip() for h in rows[0]]
-        
-        for row in rows[1:]:
-            row_dict = {}
-            for h, v in zip(headers, row):
-                val = str(v).strip() if v is not None else ""
-                row_dict[h] = val
-            data.append(row_dict)
+        headers = [_cell_text(h) for h in rows[0]]
+        
+        # Calamine yields str for text cells (the common case), so strip those
+        # inline and only route other types through _cell_text
+        data = [
+            {h: (v.strip() if type(v) is str else _cell_text(v)) for h, v in zip(headers, row)}
+            for row in rows[1:]
+        ]
             
         self.excel_data = data
         return self.excel_data
     
     def load_docx(self) -> List[Dict[str, str]]:
         """Load DOCX file and extract text chunks."""
-        doc = Document(self.docx_path)
         chunks = []
+        table_chunks = []
         
         # Extract paragraphs
         current_section = ""
         paragraph_buffer = []
+        table_idx = 0
         
-        for para in doc.paragraphs:
-            text = para.text.strip()
+        # Single streaming pass over the document XML
+        for block in _iter_body_blocks(self.docx_path):
+            if block.tag == _W_TBL:
+                table_chunks.extend(self._table_chunks(block, table_idx))
+                table_idx += 1
+                continue
+            
+            text = _paragraph_text(block).strip()
             if not text:
                 continue
             
@@ -58,85 +245,125 @@ class DataLoader:
             if len(text) < 100 and (text.isupper() or text.endswith(':')):
                 # Save previous section
                 if paragraph_buffer:
-                    chunks.append({
-                        'type': 'paragraph',
-                        'section': current_section,
-                        'content': ' '.join(paragraph_buffer),
-                        'source': 'Pharma_Clinical_Trial_Notes.docx'
-                    })
-                    paragraph_buffer = []
+                    chunks.append(self._paragraph_chunk(current_section, paragraph_buffer))
+                    paragraph_buffer.clear()
                 current_section = text
             else:
                 paragraph_buffer.append(text)
         
         # Add final buffer
         if paragraph_buffer:
-            chunks.append({
-                'type': 'paragraph',
-                'section': current_section,
-                'content': ' '.join(paragraph_buffer),
-                'source': 'Pharma_Clinical_Trial_Notes.docx'
-            })
-        
-        # Extract tables
-        for table_idx, table in enumerate(doc.tables):
-            # Get headers from first row
-            if not table.rows:
-                continue
-                
-            headers = [cell.text.strip() for cell in table.rows[0].cells]
-            
-            # Process each row
-            for row_idx, row in enumerate(table.rows[1:], start=1):
-                row_data = {}
-                row_text_parts = []
-                
-                for header, cell in zip(headers, row.cells):
-                    cell_text = cell.text.strip()
-                    row_data[header] = cell_text
-                    if cell_text:
-                        row_text_parts.append(f"{header}: {cell_text}")
-                
-                if row_text_parts:
-                    chunks.append({
-                        'type': 'table',
-                        'table_index': table_idx,
-                        'row_index': row_idx,
-                        'content': ' | '.join(row_text_parts),
-                        'structured_data': row_data,
-                        'source': 'Pharma_Clinical_Trial_Notes.docx'
-                    })
+            chunks.append(self._paragraph_chunk(current_section, paragraph_buffer))
+        
+        # Tables follow the paragraphs
+        chunks.extend(table_chunks)
         
         self.doc_chunks = chunks
         return chunks
     
+    def _paragraph_chunk(self, section: str, paragraphs: List[str]) -> Dict:
+        """Join a section's paragraphs (in a single allocation) into one chunk."""
+        content = ' '.join(paragraphs)
+        return {
+            'type': 'paragraph',
+            'section': section,
+            'content': content,
+            'match_text': build_match_text(content, {}),
+            'source': 'Pharma_Clinical_Trial_Notes.docx'
+        }
+    
+    def _table_chunks(self, tbl: etree._Element, table_idx: int) -> List[Dict]:
+        """Convert the rows of one DOCX table into chunks keyed by its header row."""
+        rows = _table_rows(tbl)
+        
+        # Get headers from first row
+        if not rows:
+            return []
+            
+        headers = [text.strip() for text in rows[0]]
+        prefixes = [f"{header}: " for header in headers]
+        chunks = []
+        
+        # Process each row
+        for row_idx, row in enumerate(rows[1:], start=1):
+            row_data = {}
+            row_text_parts = []
+            
+            for header, prefix, text in zip(headers, prefixes, row):
+                cell_text = text.strip()
+                row_data[header] = cell_text
+                if cell_text:
+                    row_text_parts.append(prefix + cell_text)
+            
+            if row_text_parts:
+                content = ' | '.join(row_text_parts)
+                chunks.append({
+                    'type': 'table',
+                    'table_index': table_idx,
+                    'row_index': row_idx,
+                    'content': content,
+                    'match_text': build_match_text(content, row_data),
+                    'structured_data': row_data,
+                    'source': 'Pharma_Clinical_Trial_Notes.docx'
+                })
+        
+        return chunks
+    
     def get_excel_chunks(self) -> List[Dict[str, str]]:
         """Convert Excel rows to searchable text chunks."""
         if not self.excel_data:
             self.load_excel()
         
-        chunks = []
-        for idx, row in enumerate(self.excel_data):
-            # Create a text representation of the row
-            text_parts = []
-            for col, value in row.items():
-                if value and str(value).strip():
-                    text_parts.append(f"{col}: {value}")
-            
-            chunks.append({
+        # Build each "col: " prefix once per column rather than per cell;
+        # cells are already stripped strings, so truthiness filters empties
+        prefixes = {col: f"{col}: " for col in self.excel_data[0]} if self.excel_data else {}
+        contents = [
+            ' | '.join([prefixes[col] + value for col, value in row.items() if value])
+            for row in self.excel_data
+        ]
+        return [
+            {
                 'type': 'excel_row',
                 'row_index': idx,
-                'content': ' | '.join(text_parts),
+                'content': content,
+                'match_text': build_match_text(content, row),
                 'structured_data': row,
                 'source': 'Pharma_Clinical_Trial_AllDrugs.xlsx'
-            })
-        
-        return chunks
+            }
+            for idx, (content, row) in enumerate(zip(contents, self.excel_data))
+        ]
+    
+    def _cache_file(self) -> Path:
+        """Cache path keyed by the content hash of both source files."""
+        h = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=16)
+        for path in (self.excel_path, self.docx_path):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        return self.cache_dir / f"{h.hexdigest()}.pkl"
     
     def load_all(self) -> Tuple[List[Dict], List[Dict], List[Dict]]:
         """Load all sources and return organized data."""
+        cache_file = self._cache_file()
+        
+        if cache_file.exists():
+            try:
+                with open(cache_file, 'rb') as f:
+                    excel_data, doc_chunks, excel_chunks = pickle.load(f)
+                self.excel_data = excel_data
+                self.doc_chunks = doc_chunks
+                return excel_data, doc_chunks, excel_chunks
+            except Exception as e:
+                print(f"Failed to load data cache: {e}")
+        
         excel_data = self.load_excel()
         doc_chunks = self.load_docx()
         excel_chunks = self.get_excel_chunks()
         
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                pickle.dump((excel_data, doc_chunks, excel_chunks), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"Failed to save data cache: {e}")
+        
         return excel_data, doc_chunks, excel_chunks
@@ -7,6 +7,12 @@ import json
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List
+import threading
+import atexit
+import os
+
+# Turns appended to the event log between full metrics.json snapshots
+SNAPSHOT_EVERY = 100
 
 
 class ChatLogger:
@@ -16,13 +22,18 @@ class ChatLogger:
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
         
-        # Configure loguru
+        # Configure loguru: records are written from a background thread in
+        # 64 KiB chunks instead of being flushed one by one. Serverless runtimes
+        # lack the shared memory its multiprocessing queue needs.
+        serverless = bool(os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
         log_file = self.log_dir / "chatbot_{time}.log"
-        logger.add(
+        self._sink_id = logger.add(
             log_file,
             format="{time} | {level} | {message}",
             level="INFO",
-            rotation="1 day"
+            rotation="1 day",
+            enqueue=not serverless,
+            buffering=65536
         )
         
         # Metrics storage
@@ -38,10 +49,18 @@ class ChatLogger:
         }
         
         self.metrics_file = self.log_dir / "metrics.json"
+        self.events_file = self.log_dir / "events.jsonl"
+        self._lock = threading.Lock()  # turns may be logged from worker threads
         self._load_metrics()
+        
+        # Append-only event log; metrics.json is only rewritten every
+        # SNAPSHOT_EVERY turns and at exit
+        self._events = open(self.events_file, 'a', buffering=1, encoding='utf-8')
+        self._unsnapshotted = 0
+        atexit.register(self.close)
     
     def _load_metrics(self):
-        """Load existing metrics if available."""
+        """Load the last snapshot, then replay events logged after it."""
         if self.metrics_file.exists():
             try:
                 with open(self.metrics_file, 'r') as f:
@@ -49,37 +68,45 @@ class ChatLogger:
                     self.metrics.update(saved_metrics)
             except:
                 pass
+        
+        if self.events_file.exists():
+            snapshot_turns = self.metrics['total_turns']
+            with open(self.events_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash
+                    # Events up to the snapshot's turn count are already in it
+                    if event['turn'] > snapshot_turns:
+                        self._apply_event(event)
     
     def _save_metrics(self):
-        """Save metrics to file."""
-        with open(self.metrics_file, 'w') as f:
+        """Snapshot metrics to file and start a fresh event log (caller holds the lock)."""
+        tmp_file = self.metrics_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w') as f:
             json.dump(self.metrics, f, indent=2)
+        os.replace(tmp_file, self.metrics_file)
+        
+        self._events.seek(0)
+        self._events.truncate()
+        self._unsnapshotted = 0
     
-    def log_query(
-        self,
-        session_id: str,
-        user_message: str,
-        assistant_message: str,
-        source_used: str,
-        retrieved_count: int,
-        is_clarification: bool = False,
-        is_unknown: bool = False,
-        is_safety_refusal: bool = False
-    ):
-        """Log a single query-response turn."""
-        # Update metrics
+    def _apply_event(self, event: Dict):
+        """Fold one turn event into the in-memory metrics."""
         self.metrics['total_turns'] += 1
         
-        if is_clarification:
+        if event['clarification']:
             self.metrics['clarifications_asked'] += 1
         
-        if is_unknown:
+        if event['unknown']:
             self.metrics['unknown_responses'] += 1
         
-        if is_safety_refusal:
+        if event['safety']:
             self.metrics['safety_refusals'] += 1
         
         # Track source usage
+        source_used = event['source']
         if source_used == 'Pharma_Clinical_Trial_Notes.docx':
             self.metrics['doc_queries'] += 1
         elif source_used == 'Pharma_Clinical_Trial_AllDrugs.xlsx':
@@ -88,13 +115,41 @@ class ChatLogger:
             self.metrics['both_queries'] += 1
         
         # Track session
-        if session_id not in self.metrics['sessions']:
-            self.metrics['sessions'][session_id] = {
-                'start_time': datetime.now().isoformat(),
+        session = self.metrics['sessions'].get(event['session'])
+        if session is None:
+            session = self.metrics['sessions'][event['session']] = {
+                'start_time': event['ts'],
                 'turn_count': 0
             }
-        self.metrics['sessions'][session_id]['turn_count'] += 1
-        self.metrics['sessions'][session_id]['last_activity'] = datetime.now().isoformat()
+        session['turn_count'] += 1
+        session['last_activity'] = event['ts']
+    
+    def _record_turn(
+        self,
+        session_id: str,
+        user_message: str,
+        assistant_message: str,
+        source_used: str,
+        retrieved_count: int,
+        is_clarification: bool = False,
+        is_unknown: bool = False,
+        is_safety_refusal: bool = False
+    ):
+        """Update metrics, append the turn event and write its log line (caller holds the lock)."""
+        event = {
+            'ts': datetime.now().isoformat(),
+            'session': session_id,
+            'source': source_used,
+            'clarification': is_clarification,
+            'unknown': is_unknown,
+            'safety': is_safety_refusal
+        }
+        self._apply_event(event)
+        
+        # Turn number lets a reload skip events already in the snapshot
+        event['turn'] = self.metrics['total_turns']
+        self._events.write(json.dumps(event) + '\n')
+        self._unsnapshotted += 1
         
         # Log the interaction
         logger.info(
@@ -106,9 +161,50 @@ class ChatLogger:
             f"Unknown: {is_unknown} | "
             f"Safety: {is_safety_refusal}"
         )
+    
+    def log_query(
+        self,
+        session_id: str,
+        user_message: str,
+        assistant_message: str,
+        source_used: str,
+        retrieved_count: int,
+        is_clarification: bool = False,
+        is_unknown: bool = False,
+        is_safety_refusal: bool = False
+    ):
+        """Log a single query-response turn."""
+        self.log_batch([{
+            'session_id': session_id,
+            'user_message': user_message,
+            'assistant_message': assistant_message,
+            'source_used': source_used,
+            'retrieved_count': retrieved_count,
+            'is_clarification': is_clarification,
+            'is_unknown': is_unknown,
+            'is_safety_refusal': is_safety_refusal
+        }])
+    
+    def log_batch(self, turns: List[Dict]):
+        """Log several turns, snapshotting metrics once enough events have accumulated."""
+        with self._lock:
+            for turn in turns:
+                self._record_turn(**turn)
+            
+            if self._unsnapshotted >= SNAPSHOT_EVERY:
+                self._save_metrics()
+    
+    def close(self):
+        """Write a final metrics snapshot and close the event and text logs."""
+        with self._lock:
+            if self._events.closed:
+                return
+            if self._unsnapshotted:
+                self._save_metrics()
+            self._events.close()
         
-        # Save metrics
-        self._save_metrics()
+        # Drains the sink's queue and flushes its buffer
+        logger.remove(self._sink_id)
     
     def get_metrics_summary(self) -> Dict:
         """Get current metrics summary."""
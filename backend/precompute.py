@@ -22,7 +22,7 @@ def main():
     retriever = Retriever()
     retriever.build_index(doc_chunks, excel_chunks)
 
-    output_path = "index.npz"
+    output_path = "index"
     print(f"Saving to {output_path}...")
     retriever.save_index(output_path)
     print("Done!")
@@ -1,67 +1,256 @@
 """
 Retrieval Module
-Implements semantic search using sentence transformers and FAISS.
+Implements semantic search using FastEmbed embeddings and exact NumPy
+cosine search over float32 matrices.
 """
-from fastembed import TextEmbedding
-
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, NamedTuple
+from collections import OrderedDict
 import re
+import operator
+import pickle
+import threading
+from pathlib import Path
 
 
 import os
 
+# Corpus encoding: texts per ONNX batch, and the corpus size above which
+# FastEmbed's data-parallel worker processes pay for their model start-up
+EMBED_BATCH_SIZE = 64
+PARALLEL_MIN_TEXTS = 2048
+
+# The chunk sidecar is committed alongside the code, so pin the pickle
+# protocol (5: out-of-band buffers, Python 3.8+) rather than whatever the
+# precompute interpreter's HIGHEST_PROTOCOL happens to be
+INDEX_PICKLE_PROTOCOL = 5
+
+# Normalized query embeddings kept per Retriever for repeated questions
+QUERY_CACHE_SIZE = 1024
+
+# Excel indicators - structured data queries
+_EXCEL_KEYWORDS = (
+    'dose', 'dosing', 'dosage', 'mg', 'frequency',
+    'adverse event', 'ae', 'aes', 'side effect',
+    'severity', 'severe', 'moderate', 'mild',
+    'outcome', 'resolved', 'ongoing',
+    'indication', 'population', 'reported'
+)
+
+# Doc indicators - narrative and label cautions
+_DOC_KEYWORDS = (
+    'caution', 'label', 'note', 'guidance', 'monitoring',
+    'warning', 'recommendation', 'context', 'trial summary',
+    'background', 'description'
+)
+
+# Dosing/AE/severity terms that only make sense for a specific drug
+_NEEDS_DRUG_KEYWORDS = (
+    'dose', 'dosing', 'dosage', 'adverse event', 'ae', 'aes',
+    'severity', 'outcome', 'caution', 'side effect'
+)
+
+# Common drug names to check against
+_DRUG_NAMES = (
+    'imatinib', 'pembrolizumab', 'metformin', 'nivolumab',
+    'trastuzumab', 'atezolizumab', 'durvalumab', 'osimertinib'
+)
+
+_INDICATIONS = ('melanoma', 'nsclc', 'diabetes', 'breast cancer', 'cml')
+
+# General safety/medical terms that should be handled by guardrails
+_GENERAL_MEDICAL_TERMS = ('renal', 'kidney', 'hepatic', 'liver', 'impairment')
+
+
+def _substring_alternation(keywords: Tuple[str, ...]) -> re.Pattern:
+    """One compiled scan that finds any of the keywords anywhere in the text."""
+    return re.compile('|'.join(map(re.escape, sorted(keywords, key=len, reverse=True))))
+
+
+_EXCEL_RE = _substring_alternation(_EXCEL_KEYWORDS)
+_DOC_RE = _substring_alternation(_DOC_KEYWORDS)
+_ANY_SOURCE_RE = _substring_alternation(_EXCEL_KEYWORDS + _DOC_KEYWORDS)
+_NEEDS_DRUG_RE = _substring_alternation(_NEEDS_DRUG_KEYWORDS)
+_DRUG_NAME_RE = _substring_alternation(_DRUG_NAMES)
+_INDICATION_RE = _substring_alternation(_INDICATIONS)
+_GENERAL_MEDICAL_RE = _substring_alternation(_GENERAL_MEDICAL_TERMS)
+
+
+def _keyword_score(pattern: re.Pattern, keywords: Tuple[str, ...], text: str) -> int:
+    """Number of distinct keywords found in text (overlaps such as 'ae'/'aes' both count)."""
+    # Most queries hit no keyword at all, which a single scan settles
+    if pattern.search(text) is None:
+        return 0
+    return sum(1 for kw in keywords if kw in text)
+
+
+class Hit(NamedTuple):
+    """A search result: the indexed chunk (shared, not copied) and how it scored."""
+    chunk: Dict
+    score: float  # squared L2 distance, lower is better
+    source_type: str  # 'doc' or 'excel'
+
+
+_BY_SCORE = operator.attrgetter('score')
+
+# Source type of each index row, stored as its position in this tuple
+_SOURCE_TYPES = ('doc', 'excel')
+
+
+def _normalize_rows(vectors: np.ndarray, in_place: bool = False) -> np.ndarray:
+    """L2-normalize each row so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    if in_place:
+        vectors /= norms
+        return vectors
+    return vectors / norms
+
+
+def _aligned_empty(shape: Tuple[int, int]) -> np.ndarray:
+    """Uninitialized C-contiguous float32 matrix whose data starts on a 64-byte boundary."""
+    nbytes = shape[0] * shape[1] * 4
+    buffer = np.empty(nbytes + 64, dtype=np.uint8)
+    offset = -buffer.ctypes.data % 64
+    return buffer[offset:offset + nbytes].view(np.float32).reshape(shape)
+
+
+def _as_aligned_float32(matrix: np.ndarray) -> np.ndarray:
+    """C-contiguous float32 copy of a matrix whose data starts on a 64-byte boundary."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.flags['C_CONTIGUOUS'] and matrix.ctypes.data % 64 == 0:
+        return matrix
+    
+    aligned = _aligned_empty(matrix.shape)
+    aligned[...] = matrix
+    return aligned
+
+
 class Retriever:
     """Handles embedding generation and semantic search."""
     
     def __init__(self, model_name: str = 'BAAI/bge-small-en-v1.5'):
         """Initialize with a FastEmbed model (ONNX based, lightweight)."""
+        # Imported here so that loading this module (e.g. for query
+        # classification) does not pull in ONNX Runtime
+        from fastembed import TextEmbedding
+        
         # FastEmbed handles model download
         # For Vercel/Serverless, we must use /tmp for writing files
         cache_dir = None
-        if os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        self.serverless = bool(os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME"))
+        if self.serverless:
             cache_dir = "/tmp/fastembed_cache"
             os.makedirs(cache_dir, exist_ok=True)
             
         self.model = TextEmbedding(model_name=model_name, cache_dir=cache_dir)
-        self.doc_embeddings = None
-        self.excel_embeddings = None
-        self.doc_chunks = []
-        self.excel_chunks = []
         
+        # One matrix for both sources; sources[i] indexes _SOURCE_TYPES for row i
+        self.embeddings = None
+        self.sources = np.empty(0, dtype=np.int8)
+        self.chunks = []
+        self._source_columns = {}
+        
+        # Query text -> normalized embedding, least recently used first
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+    def _embed_corpus(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode index texts in batches (data-parallel across cores for large
+        corpora) into one aligned float32 matrix of unit-norm rows.
+        """
+        # Serverless runtimes lack the shared memory multiprocessing needs;
+        # ONNX Runtime still threads each batch across cores there
+        parallel = None
+        if len(texts) >= PARALLEL_MIN_TEXTS and not self.serverless:
+            parallel = 0  # one worker per core
+        
+        # Stream vectors straight into the final matrix: no intermediate list
+        # of per-text arrays and no normalize/align copies afterwards
+        embeddings = None
+        vectors = self.model.embed(texts, batch_size=EMBED_BATCH_SIZE, parallel=parallel)
+        for i, vector in enumerate(vectors):
+            if embeddings is None:
+                embeddings = _aligned_empty((len(texts), vector.shape[0]))
+            embeddings[i] = vector
+        
+        if embeddings is None:
+            return _aligned_empty((0, 0))
+        
+        return _normalize_rows(embeddings, in_place=True)
+    
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalized query embeddings, encoding only queries not seen recently."""
+        # Surrounding whitespace is dropped by the tokenizer, so it is not part of the key
+        keys = [q.strip() for q in queries]
+        found = {}
+        
+        with self._query_cache_lock:
+            for key in keys:
+                if key in self._query_cache:
+                    self._query_cache.move_to_end(key)
+                    found[key] = self._query_cache[key]
+        
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            embeddings = _normalize_rows(np.array(list(self.model.embed(missing))))
+            with self._query_cache_lock:
+                for key, embedding in zip(missing, embeddings):
+                    self._query_cache[key] = found[key] = embedding
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        
+        return np.stack([found[key] for key in keys])
+    
+    def _index_sources(self):
+        """Cache the index rows belonging to each source type."""
+        self._source_columns = {
+            source: np.flatnonzero(self.sources == code)
+            for code, source in enumerate(_SOURCE_TYPES)
+        }
+    
     def build_index(self, doc_chunks: List[Dict], excel_chunks: List[Dict]):
-        """Build Numpy-based indices for both sources."""
-        # Build doc index
-        if doc_chunks:
-            doc_texts = [chunk['content'] for chunk in doc_chunks]
-            # FastEmbed returns a generator, convert to numpy array
-            self.doc_embeddings = np.array(list(self.model.embed(doc_texts)))
-            self.doc_chunks = doc_chunks
-        
-        # Build excel index
-        if excel_chunks:
-            excel_texts = [chunk['content'] for chunk in excel_chunks]
-            self.excel_embeddings = np.array(list(self.model.embed(excel_texts)))
-            self.excel_chunks = excel_chunks
+        """Build one Numpy index over both sources, tagging each row with its source."""
+        self.chunks = doc_chunks + excel_chunks
+        self.sources = np.repeat(
+            np.arange(len(_SOURCE_TYPES), dtype=np.int8),
+            [len(doc_chunks), len(excel_chunks)]
+        )
+        self.embeddings = None
+        if self.chunks:
+            texts = [chunk['content'] for chunk in self.chunks]
+            self.embeddings = self._embed_corpus(texts)
+        self._index_sources()
 
     def save_index(self, path: str):
-        """Save embeddings and chunks to disk."""
-        np.savez_compressed(
-            path,
-            doc_embeddings=self.doc_embeddings,
-            excel_embeddings=self.excel_embeddings,
-            doc_chunks=self.doc_chunks,  # Note: storing dicts in npz is not efficient, but works for small data
-            excel_chunks=self.excel_chunks
-        )
+        """
+        Save the index to a directory: the embedding matrix and source mask as
+        raw .npy files (so they can be memory-mapped on load) plus a pickled
+        chunk sidecar.
+        """
+        index_dir = Path(path)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Unit-norm, C-contiguous float32 so BLAS can use the mapped pages
+        # directly (.npy headers are padded so the data stays 64-byte aligned)
+        np.save(index_dir / 'embeddings.npy', _as_aligned_float32(self.embeddings))
+        np.save(index_dir / 'sources.npy', self.sources)
+        
+        with open(index_dir / 'chunks.pkl', 'wb') as f:
+            pickle.dump(self.chunks, f, protocol=INDEX_PICKLE_PROTOCOL)
 
     def load_index(self, path: str) -> bool:
-        """Load embeddings and chunks from disk."""
+        """Load an index directory written by save_index."""
         try:
-            data = np.load(path, allow_pickle=True)
-            self.doc_embeddings = data['doc_embeddings']
-            self.excel_embeddings = data['excel_embeddings']
-            self.doc_chunks = data['doc_chunks'].tolist()
-            self.excel_chunks = data['excel_chunks'].tolist()
+            index_dir = Path(path)
+            # Memory-mapped: pages are read on first use instead of all at startup.
+            # The saved matrix is already normalized, so no copy is made here.
+            self.embeddings = np.load(index_dir / 'embeddings.npy', mmap_mode='r')
+            self.sources = np.load(index_dir / 'sources.npy')
+            with open(index_dir / 'chunks.pkl', 'rb') as f:
+                self.chunks = pickle.load(f)
+            self._index_sources()
             return True
         except Exception as e:
             print(f"Failed to load index: {e}")
@@ -71,24 +260,12 @@ class Retriever:
         """Determine which source to prioritize based on query type."""
         query_lower = query.lower()
         
-        # Excel indicators - structured data queries
-        excel_keywords = [
-            'dose', 'dosing', 'dosage', 'mg', 'frequency',
-            'adverse event', 'ae', 'aes', 'side effect',
-            'severity', 'severe', 'moderate', 'mild',
-            'outcome', 'resolved', 'ongoing',
-            'indication', 'population', 'reported'
-        ]
-        
-        # Doc indicators - narrative and label cautions
-        doc_keywords = [
-            'caution', 'label', 'note', 'guidance', 'monitoring',
-            'warning', 'recommendation', 'context', 'trial summary',
-            'background', 'description'
-        ]
-        
-        excel_score = sum(1 for kw in excel_keywords if kw in query_lower)
-        doc_score = sum(1 for kw in doc_keywords if kw in query_lower)
+        # Greetings and off-topic queries hit neither set: settle them in one scan
+        if _ANY_SOURCE_RE.search(query_lower) is None:
+            return 'both'
+        
+        excel_score = _keyword_score(_EXCEL_RE, _EXCEL_KEYWORDS, query_lower)
+        doc_score = _keyword_score(_DOC_RE, _DOC_KEYWORDS, query_lower)
         
         if doc_score > excel_score:
             return 'doc'
@@ -101,30 +278,16 @@ class Retriever:
         """Check if query needs clarification (e.g., missing drug name)."""
         query_lower = query.lower()
         
-        # Check for dosing/AE/severity queries without drug name
-        needs_drug_keywords = [
-            'dose', 'dosing', 'dosage', 'adverse event', 'ae', 'aes',
-            'severity', 'outcome', 'caution', 'side effect'
-        ]
-        
-        # Common drug names to check against
-        drug_list = [
-            'imatinib', 'pembrolizumab', 'metformin', 'nivolumab',
-            'trastuzumab', 'atezolizumab', 'durvalumab', 'osimertinib'
-        ]
-        
         # Check if query has drug-specific keywords but no drug name
-        has_drug_keyword = any(kw in query_lower for kw in needs_drug_keywords)
-        has_drug_name = any(drug in query_lower for drug in drug_list)
+        has_drug_keyword = _NEEDS_DRUG_RE.search(query_lower) is not None
+        has_drug_name = _DRUG_NAME_RE.search(query_lower) is not None
         
         # Also check for indication-based queries
-        has_indication = any(ind in query_lower for ind in [
-            'melanoma', 'nsclc', 'diabetes', 'breast cancer', 'cml'
-        ])
+        has_indication = _INDICATION_RE.search(query_lower) is not None
         
         # Exception for general safety/medical queries that should be handled by guardrails
         # e.g. "dosage adjustment for renal impairment" should go to safety check, not clarification
-        is_general_medical = any(term in query_lower for term in ['renal', 'kidney', 'hepatic', 'liver', 'impairment'])
+        is_general_medical = _GENERAL_MEDICAL_RE.search(query_lower) is not None
         
         if has_drug_keyword and not (has_drug_name or has_indication) and not is_general_medical:
             return True, "Could you specify the drug name to help me answer accurately?"
@@ -136,61 +299,75 @@ class Retriever:
         query: str, 
         top_k: int = 5,
         source_preference: str = 'both'
-    ) -> Tuple[List[Dict], List[Dict]]:
+    ) -> Tuple[List[Hit], List[Hit]]:
         """
         Search for relevant chunks using Numpy (L2 distance).
         Returns: (doc_results, excel_results)
         """
-        query_embedding = list(self.model.embed([query]))[0]
+        return self.search_batch([query], top_k, [source_preference])[0]
+    
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        source_preferences: Optional[List[str]] = None
+    ) -> List[Tuple[List[Hit], List[Hit]]]:
+        """
+        Search several queries at once with a single embedding call and one
+        distance matrix over both sources.
+        Returns: one (doc_results, excel_results) tuple per query
+        """
+        if not queries:
+            return []
+        if source_preferences is None:
+            source_preferences = ['both'] * len(queries)
+        
+        results = {source: [[] for _ in queries] for source in _SOURCE_TYPES}
+        if self.embeddings is None or len(self.embeddings) == 0:
+            return list(zip(results['doc'], results['excel']))
+        
+        query_embeddings = self._embed_queries(queries)
         
-        doc_results = []
-        excel_results = []
+        # Cosine similarity for every (query, chunk) pair in one BLAS call;
+        # for unit vectors the squared L2 distance is 2 - 2*cos, which keeps
+        # scores on the same lower-is-better scale as before
+        dists = 2.0 - 2.0 * (query_embeddings @ self.embeddings.T)
         
-        # Search doc if needed
-        if source_preference in ['doc', 'both'] and self.doc_embeddings is not None and len(self.doc_embeddings) > 0:
-            # L2 Distance: sum((a-b)^2)
-            dists = np.sum((self.doc_embeddings - query_embedding)**2, axis=1)
-            # Get top k indices (smallest distance)
-            indices = np.argsort(dists)[:top_k]
+        for source, columns in self._source_columns.items():
+            # Only rank this source's rows, for the queries that asked for it
+            rows = [i for i, pref in enumerate(source_preferences) if pref in [source, 'both']]
+            k = min(top_k, len(columns))
+            if not rows or k <= 0:
+                continue
+            source_dists = dists[np.ix_(rows, columns)]
             
-            for idx in indices:
-                result = self.doc_chunks[idx].copy()
-                result['score'] = float(dists[idx])
-                doc_results.append(result)
-        
-        # Search excel if needed
-        if source_preference in ['excel', 'both'] and self.excel_embeddings is not None and len(self.excel_embeddings) > 0:
-            dists = np.sum((self.excel_embeddings - query_embedding)**2, axis=1)
-            indices = np.argsort(dists)[:top_k]
+            # Top k per query (smallest distance): partition in O(N), then
+            # order only the k survivors
+            part = np.argpartition(source_dists, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(part, np.argsort(np.take_along_axis(source_dists, part, axis=1), axis=1), axis=1)
             
-            for idx in indices:
-                result = self.excel_chunks[idx].copy()
-                result['score'] = float(dists[idx])
-                excel_results.append(result)
+            for row, row_dists, indices in zip(rows, source_dists, top):
+                results[source][row].extend([
+                    Hit(self.chunks[columns[idx]], float(row_dists[idx]), source)
+                    for idx in indices
+                ])
         
-        return doc_results, excel_results
+        return list(zip(results['doc'], results['excel']))
     
     def get_best_results(
         self,
-        doc_results: List[Dict],
-        excel_results: List[Dict],
+        doc_results: List[Hit],
+        excel_results: List[Hit],
         max_results: int = 3
-    ) -> Tuple[List[Dict], str]:
+    ) -> Tuple[List[Hit], str]:
         """
         Select the best results and determine primary source.
         Returns: (selected_results, primary_source)
         """
-        # Combine and sort by score
-        all_results = []
-        for res in doc_results:
-            res['source_type'] = 'doc'
-            all_results.append(res)
-        for res in excel_results:
-            res['source_type'] = 'excel'
-            all_results.append(res)
-        
-        # Sort by score (lower is better for L2 distance)
-        all_results.sort(key=lambda x: x['score'])
+        # Combine and sort by score (lower is better for L2 distance);
+        # hits already carry their source type
+        all_results = doc_results + excel_results
+        all_results.sort(key=_BY_SCORE)
         
         # Take top results
         selected = all_results[:max_results]
@@ -199,8 +376,8 @@ class Retriever:
         if not selected:
             return [], 'none'
         
-        doc_count = sum(1 for r in selected if r['source_type'] == 'doc')
-        excel_count = sum(1 for r in selected if r['source_type'] == 'excel')
+        doc_count = sum(1 for r in selected if r.source_type == 'doc')
+        excel_count = sum(1 for r in selected if r.source_type == 'excel')
         
         if doc_count > 0 and excel_count > 0:
             primary_source = 'both'
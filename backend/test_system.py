@@ -2,58 +2,91 @@
 System Test Script
 Verifies all components are working correctly.
 """
+import os
 import sys
 import importlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 
-def print_status(check_name, passed, message=""):
-    """Print colored status message."""
+def _try_import(name):
+    """Import a module, reusing it from sys.modules if already loaded."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    # None entries mark blocked imports; import_module raises ImportError for them
+    return importlib.import_module(name)
+
+
+def _probe_import(name):
+    """Try to import a package, returning the error instead of raising it.
+    
+    Any exception counts: concurrent first imports can fail with a
+    deadlock RuntimeError or a partially initialized module, not just
+    ImportError.
+    """
+    try:
+        _try_import(name)
+        return None
+    except Exception as e:
+        return e
+
+
+def status_lines(check_name, passed, message=""):
+    """Lines of a colored status message."""
     status = "✅ PASS" if passed else "❌ FAIL"
-    print(f"{status} - {check_name}")
+    lines = [f"{status} - {check_name}"]
     if message:
-        print(f"    {message}")
+        lines.append(f"    {message}")
+    return lines
+
+
+def print_status(check_name, passed, message=""):
+    """Print colored status message."""
+    for line in status_lines(check_name, passed, message):
+        print(line)
 
 
 def check_python_version():
-    """Check Python version >= 3.8"""
+    """Check Python version >= 3.8. Returns (passed, lines to print)."""
     version = sys.version_info
     passed = version.major == 3 and version.minor >= 8
     msg = f"Python {version.major}.{version.minor}.{version.micro}"
-    print_status("Python Version", passed, msg)
-    return passed
+    return passed, status_lines("Python Version", passed, msg)
 
 
 def check_dependencies():
-    """Check if all required packages are installed."""
+    """Check if all required packages are installed. Returns (passed, lines to print)."""
     required = [
-        'fastapi', 'uvicorn', 'pandas', 'openpyxl', 'docx',
+        'fastapi', 'uvicorn', 'pandas', 'python_calamine', 'lxml',
         'sentence_transformers', 'faiss', 'pydantic', 'gradio',
         'loguru', 'numpy'
     ]
     
+    # First imports are mostly file I/O, so probe the packages concurrently;
+    # results are printed afterwards in list order
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        errors = list(pool.map(_probe_import, required))
+    
     all_installed = True
-    for package in required:
-        package_name = 'faiss' if package == 'faiss' else package
-        package_name = 'python-docx' if package == 'docx' else package_name
-        
-        try:
-            if package == 'docx':
-                importlib.import_module('docx')
-            elif package == 'faiss':
-                importlib.import_module('faiss')
+    lines = []
+    for package, error in zip(required, errors):
+        if error is None:
+            lines += status_lines(f"Package: {package}", True)
+        else:
+            if isinstance(error, ModuleNotFoundError) and error.name == package:
+                message = "Not installed"
             else:
-                importlib.import_module(package)
-            print_status(f"Package: {package}", True)
-        except ImportError:
-            print_status(f"Package: {package}", False, "Not installed")
+                message = f"{type(error).__name__}: {error}"
+            lines += status_lines(f"Package: {package}", False, message)
             all_installed = False
     
-    return all_installed
+    return all_installed, lines
 
 
 def check_data_files():
-    """Check if source data files exist."""
+    """Check if source data files exist. Returns (passed, lines to print)."""
     base_path = Path(__file__).parent
     files = [
         'Pharma_Clinical_Trial_AllDrugs.xlsx',
@@ -61,46 +94,64 @@ def check_data_files():
     ]
     
     all_exist = True
+    lines = []
     for file in files:
         file_path = base_path / file
-        exists = file_path.exists()
-        print_status(f"Data File: {file}", exists)
+        exists = os.path.lexists(file_path)
+        lines += status_lines(f"Data File: {file}", exists)
         if not exists:
             all_exist = False
     
-    return all_exist
+    return all_exist, lines
 
 
 def check_modules():
-    """Check if all custom modules can be imported."""
+    """Check if all custom modules can be imported. Returns (passed, lines to print)."""
     modules = [
         'data_loader', 'retriever', 'chatbot_engine', 'logger'
     ]
     
     all_imported = True
+    lines = []
     for module in modules:
         try:
-            importlib.import_module(module)
-            print_status(f"Module: {module}", True)
+            _try_import(module)
+            lines += status_lines(f"Module: {module}", True)
         except Exception as e:
-            print_status(f"Module: {module}", False, str(e))
+            lines += status_lines(f"Module: {module}", False, str(e))
             all_imported = False
     
-    return all_imported
+    return all_imported, lines
+
+
+@lru_cache(maxsize=1)
+def _load():
+    """Load both source files once; later tests reuse the same result."""
+    from data_loader import DataLoader
+    base_path = Path(__file__).parent
+    
+    loader = DataLoader(
+        str(base_path / 'Pharma_Clinical_Trial_AllDrugs.xlsx'),
+        str(base_path / 'Pharma_Clinical_Trial_Notes.docx')
+    )
+    return loader.load_all()
+
+
+@lru_cache(maxsize=1)
+def _retriever():
+    """Build the retrieval index once; later retrieval tests only search it."""
+    from retriever import Retriever
+    
+    excel_df, doc_chunks, excel_chunks = _load()
+    retriever = Retriever()
+    retriever.build_index(doc_chunks, excel_chunks)
+    return retriever
 
 
 def test_data_loading():
     """Test if data can be loaded."""
     try:
-        from data_loader import DataLoader
-        base_path = Path(__file__).parent
-        
-        loader = DataLoader(
-            str(base_path / 'Pharma_Clinical_Trial_AllDrugs.xlsx'),
-            str(base_path / 'Pharma_Clinical_Trial_Notes.docx')
-        )
-        
-        excel_df, doc_chunks, excel_chunks = loader.load_all()
+        excel_df, doc_chunks, excel_chunks = _load()
         
         passed = len(excel_df) > 0 and len(doc_chunks) > 0 and len(excel_chunks) > 0
         msg = f"Loaded {len(excel_chunks)} Excel rows, {len(doc_chunks)} Doc chunks"
@@ -114,20 +165,8 @@ def test_data_loading():
 def test_retrieval():
     """Test if retrieval system works."""
     try:
-        from data_loader import DataLoader
-        from retriever import Retriever
-        base_path = Path(__file__).parent
-        
-        # Load data
-        loader = DataLoader(
-            str(base_path / 'Pharma_Clinical_Trial_AllDrugs.xlsx'),
-            str(base_path / 'Pharma_Clinical_Trial_Notes.docx')
-        )
-        excel_df, doc_chunks, excel_chunks = loader.load_all()
-        
-        # Build index
-        retriever = Retriever()
-        retriever.build_index(doc_chunks, excel_chunks)
+        # Load data and build the index (shared across retrieval tests)
+        retriever = _retriever()
         
         # Test search
         doc_results, excel_results = retriever.search("What's the dose for Metformin?")
@@ -148,25 +187,28 @@ def main():
     print("=" * 60)
     print()
     
-    print("1. Checking Python Environment...")
-    print("-" * 60)
-    python_ok = check_python_version()
-    print()
-    
-    print("2. Checking Dependencies...")
-    print("-" * 60)
-    deps_ok = check_dependencies()
-    print()
+    # The four environment checks are independent: run them concurrently,
+    # then print their sections in order
+    checks = [
+        ("1. Checking Python Environment...", check_python_version),
+        ("2. Checking Dependencies...", check_dependencies),
+        ("3. Checking Data Files...", check_data_files),
+        ("4. Checking Custom Modules...", check_modules),
+    ]
+    with ThreadPoolExecutor(max_workers=len(checks)) as pool:
+        futures = [pool.submit(check) for _, check in checks]
     
-    print("3. Checking Data Files...")
-    print("-" * 60)
-    data_ok = check_data_files()
-    print()
+    results = []
+    for (header, _), future in zip(checks, futures):
+        passed, lines = future.result()
+        print(header)
+        print("-" * 60)
+        for line in lines:
+            print(line)
+        print()
+        results.append(passed)
     
-    print("4. Checking Custom Modules...")
-    print("-" * 60)
-    modules_ok = check_modules()
-    print()
+    python_ok, deps_ok, data_ok, modules_ok = results
     
     if python_ok and deps_ok and data_ok and modules_ok:
         print("5. Testing Data Loading...")